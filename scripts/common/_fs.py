@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+============================================================================
+Caelis - Shared Script Helpers
+============================================================================
+Source tree traversal and command-line helpers shared by the analysis and
+formatting scripts.
+"""
+
+import argparse
+import functools
+import os
+
+# Directories never descended into when looking for project sources
+SKIP_DIRS = frozenset({'build', 'external', '.git'})
+
+# Every C/C++ file type either script looks for; walks collect all of them
+# once and callers filter the result down to the extensions they need
+CPP_EXTENSIONS = ('.c', '.cc', '.cpp', '.cxx', '.h', '.hh', '.hpp', '.hxx', '.inl')
+
+@functools.lru_cache(maxsize=8)
+def _walk_cpp_files(root, skip_dirs):
+    """Return all C/C++ files below root, skipping directories in skip_dirs."""
+    source_files = []
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in skip_dirs:
+                            stack.append(entry.path)
+                    elif entry.name.endswith(CPP_EXTENSIONS) and entry.is_file():
+                        source_files.append(entry.path)
+        except OSError:
+            pass
+    return tuple(source_files)
+
+def walk_sources(root, extensions, skip_dirs=SKIP_DIRS):
+    """Return all files below root whose names end with one of extensions.
+    
+    extensions must be a tuple drawn from CPP_EXTENSIONS and skip_dirs a
+    frozenset. The underlying walk is cached per (root, skip_dirs) for the
+    lifetime of the process, so callers asking for different extensions under
+    the same root share a single traversal. The flip side is that files
+    added or removed after the first walk are not seen by later calls; a
+    long-running driver must call invalidate_walk_cache() to pick them up.
+    """
+    return tuple(path for path in _walk_cpp_files(root, skip_dirs)
+                 if path.endswith(extensions))
+
+def invalidate_walk_cache():
+    """Forget all cached walks so the next walk_sources call rescans."""
+    _walk_cpp_files.cache_clear()
+
+def positive_int(value):
+    """argparse type accepting only integers greater than zero."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
@@ -8,31 +8,76 @@ This script runs static analysis tools on the C++ codebase.
 
 import os
 import sys
+import shutil
 import subprocess
 import argparse
+import functools
+import hashlib
 import json
+import re
+import shlex
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-def check_tool(tool_name, install_instructions):
-    """Check if a tool is available."""
-    try:
-        result = subprocess.run([tool_name, '--version'], 
-                              capture_output=True, text=True)
-        if result.returncode == 0:
-            print(f"✓ Found {tool_name}")
-            return True
-    except FileNotFoundError:
-        pass
-    
-    print(f"✗ {tool_name} not found")
-    print(f"  Install: {install_instructions}")
+from _fs import SKIP_DIRS, positive_int, walk_sources
+
+SOURCE_EXTENSIONS = ('.cpp', '.cc', '.cxx')
+HEADER_EXTENSIONS = ('.h', '.hpp', '.hxx', '.inl')
+DIAGNOSTIC_RE = re.compile(r'^(.+?):\d+:\d+: (warning|error):')
+DIAGNOSTIC_BYTES_RE = re.compile(rb'^(.+?):\d+:\d+: (warning|error):', re.M)
+
+# Serializes output from tools running concurrently
+_output_lock = threading.Lock()
+
+# Maximum number of files handed to one clang-tidy process
+TIDY_BATCH_SIZE = 8
+
+@functools.lru_cache(maxsize=None)
+def check_tool(tool_name, install_instructions, quiet=False):
+    """Check if a tool is available on PATH."""
+    path = shutil.which(tool_name)
+    if path:
+        if not quiet:
+            print(f"✓ Found {tool_name} at {path}")
+        return True
+    
+    print(f"✗ {tool_name} not found\n  Install: {install_instructions}")
     return False
 
-def run_cppcheck(source_dirs):
+def stream_command(cmd, on_line):
+    """Run a command, passing each line of its combined output to on_line.
+    
+    Output is consumed as it is produced instead of being buffered in full.
+    Undecodable bytes (e.g. non-UTF-8 source lines echoed by the tool) are
+    replaced rather than aborting the stream. Returns the process exit code.
+    """
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          bufsize=1, text=True, errors='replace') as proc:
+        for line in proc.stdout:
+            on_line(line.rstrip('\n'))
+    return proc.returncode
+
+def prefixed_log(prefix):
+    """Return a print-like function that tags every output line with prefix.
+    
+    Used when several tools run at once so their output stays attributable.
+    """
+    def log(text=''):
+        lines = [f"[{prefix}] {line}" for line in str(text).split('\n')]
+        with _output_lock:
+            sys.stdout.write('\n'.join(lines) + '\n')
+            sys.stdout.flush()
+    return log
+
+def banner(title):
+    """Return a section banner as a single string."""
+    return "\n" + "="*60 + f"\n{title}\n" + "="*60
+
+def run_cppcheck(source_dirs, jobs=None, cache_dir=None, log=print, quiet=False):
     """Run cppcheck static analysis."""
-    print("\n" + "="*60)
-    print("Running cppcheck...")
-    print("="*60)
+    if not quiet:
+        log(banner("Running cppcheck..."))
     
     cmd = [
         'cppcheck',
@@ -45,92 +90,383 @@ def run_cppcheck(source_dirs):
         '--template={file}:{line}: {severity}: {message} [{id}]'
     ]
     
+    if jobs:
+        cmd.append(f'-j{jobs}')
+    
+    # Let cppcheck keep per-file results between runs so only changed files
+    # are re-analyzed. The build dir has to exist before cppcheck starts.
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        cmd.append(f'--cppcheck-build-dir={cache_dir}')
+    
     # Add source directories
-    for source_dir in source_dirs:
-        if os.path.exists(source_dir):
-            cmd.append(source_dir)
+    cmd.extend(d for d in source_dirs if Path(d).is_dir())
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        issues = 0
         
-        if result.stdout:
-            print("Issues found:")
-            print(result.stdout)
-        else:
-            print("No issues found by cppcheck!")
+        def report(line):
+            nonlocal issues
+            if issues == 0:
+                log("Issues found:")
+            issues += 1
+            log(line)
+        
+        returncode = stream_command(cmd, report)
         
-        if result.stderr:
-            print("Warnings/Info:")
-            print(result.stderr)
+        if issues == 0:
+            log("No issues found by cppcheck!")
             
-        return result.returncode
+        return returncode
     except Exception as e:
-        print(f"Error running cppcheck: {e}")
+        log(f"Error running cppcheck: {e}")
         return 1
 
-def run_clang_tidy(build_dir):
+def _project_path(path):
+    """Return path relative to the project root, or None if it is outside it."""
+    rel_path = os.path.relpath(path)
+    parts = Path(rel_path).parts
+    
+    # Skip fetched dependencies and anything outside the project tree
+    if not parts or parts[0] == os.pardir or SKIP_DIRS.intersection(parts):
+        return None
+    return rel_path
+
+def _include_dirs(entry):
+    """Return the project include directories used by a compile command."""
+    args = entry.get('arguments') or shlex.split(entry.get('command', ''),
+                                                 posix=(os.name != 'nt'))
+    include_dirs = []
+    for i, arg in enumerate(args):
+        if arg in ('-I', '/I') and i + 1 < len(args):
+            include_dir = args[i + 1]
+        elif arg.startswith(('-I', '/I')) and len(arg) > 2:
+            include_dir = arg[2:]
+        else:
+            continue
+        
+        include_dir = os.path.join(entry.get('directory', ''), include_dir.strip('"'))
+        include_dir = _project_path(os.path.normpath(include_dir))
+        if include_dir:
+            include_dirs.append(include_dir)
+    
+    return include_dirs
+
+def load_compile_commands(compile_commands):
+    """Map each project translation unit in compile_commands.json to its entries.
+    
+    Each unit maps to {'include_dirs': [...], 'commands': [...]}, where the
+    commands are the (directory, arguments or command) pairs it is built with.
+    """
+    with open(compile_commands, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    
+    units = {}
+    for entry in entries:
+        path = os.path.normpath(os.path.join(entry.get('directory', ''), entry['file']))
+        rel_path = _project_path(path)
+        
+        if rel_path and rel_path.endswith(SOURCE_EXTENSIONS):
+            unit = units.setdefault(rel_path, {'include_dirs': [], 'commands': []})
+            include_dirs = unit['include_dirs']
+            include_dirs.extend(d for d in _include_dirs(entry) if d not in include_dirs)
+            unit['commands'].append([entry.get('directory', ''),
+                                     entry.get('arguments') or entry.get('command', '')])
+    
+    return units
+
+@functools.lru_cache(maxsize=None)
+def _headers_below(directory):
+    """Return the headers below directory and the newest of their mtimes."""
+    # Filter one walk of the project instead of walking each directory, so
+    # the traversal is shared with every other caller of walk_sources('.')
+    directory = os.path.normpath(directory)
+    prefix = os.path.join(directory, '')
+    headers = []
+    newest = 0
+    for header in walk_sources('.', HEADER_EXTENSIONS, SKIP_DIRS):
+        header = os.path.normpath(header)
+        if directory != os.curdir and not header.startswith(prefix):
+            continue
+        headers.append(header)
+        try:
+            newest = max(newest, os.stat(header).st_mtime_ns)
+        except OSError:
+            pass
+    return tuple(headers), newest
+
+@functools.lru_cache(maxsize=None)
+def _config_files_mtime(directory):
+    """Return the newest mtime of any .clang-tidy from directory up to the root."""
+    newest = 0
+    while True:
+        config = os.path.join(directory, '.clang-tidy')
+        try:
+            newest = max(newest, os.stat(config).st_mtime_ns)
+        except OSError:
+            pass
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return newest
+        directory = parent
+
+@functools.lru_cache(maxsize=None)
+def _clang_tidy_binary():
+    """Return the resolved clang-tidy path and its mtime, identifying the binary."""
+    path = shutil.which('clang-tidy')
+    if not path:
+        return None
+    path = os.path.realpath(path)
+    try:
+        return [path, os.stat(path).st_mtime_ns]
+    except OSError:
+        return [path, 0]
+
+def _tidy_stamp(source_file, unit, build_dir):
+    """Return the cache stamp for a translation unit.
+    
+    The stamp covers the file itself, the set and mtimes of the headers it can
+    include from the project, every .clang-tidy from its directory up to the
+    root, its compile commands, the build dir and the clang-tidy binary, so
+    changing, adding, removing or moving any of them invalidates the cached
+    result. Returns None if the file cannot be stat'd.
+    """
+    source_dir = os.path.dirname(source_file) or '.'
+    headers = set()
+    deps_mtime = _config_files_mtime(os.path.abspath(source_dir))
+    for directory in [source_dir, *unit['include_dirs']]:
+        dir_headers, newest = _headers_below(directory)
+        headers.update(dir_headers)
+        deps_mtime = max(deps_mtime, newest)
+    
+    settings = [unit['commands'], os.path.abspath(build_dir), _clang_tidy_binary(),
+                sorted(headers)]
+    settings_hash = hashlib.sha256(
+        json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    try:
+        return [os.stat(source_file).st_mtime_ns, deps_mtime, settings_hash]
+    except OSError:
+        return None
+
+def load_tidy_cache(cache_file):
+    """Load the clang-tidy result cache, or an empty one if unavailable."""
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_tidy_cache(cache_file, cache, log=print):
+    """Write the clang-tidy result cache."""
+    try:
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+    except OSError as e:
+        log(f"Warning: could not write {cache_file}: {e}")
+
+def _tidy_batch(source_files, build_dir):
+    """Run clang-tidy on a batch of source files in one process.
+    
+    Output is returned as raw bytes; callers decode it only when printing.
+    """
+    cmd = [
+        'clang-tidy',
+        *source_files,
+        f'-p={build_dir}',
+        '--quiet'
+    ]
+    
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return source_files, result.stdout, result.returncode
+
+def find_run_clang_tidy():
+    """Locate LLVM's run-clang-tidy driver, if installed."""
+    for name in ('run-clang-tidy', 'run-clang-tidy.py'):
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+def _clean_units(source_files, units, diagnostic_paths):
+    """Return the source files that no diagnostic can be attributed to.
+    
+    A diagnostic in a translation unit marks that unit. One in any other file,
+    typically a header, marks every unit that can include it, i.e. whose own
+    directory or project include dirs contain that file.
+    """
+    def key(path):
+        return os.path.normcase(os.path.abspath(path))
+    
+    dirty = {key(path) for path in diagnostic_paths}
+    dirty_headers = dirty.difference(key(unit) for unit in units)
+    clean = []
+    for source_file in source_files:
+        if key(source_file) in dirty:
+            continue
+        
+        dirs = [os.path.dirname(source_file) or '.', *units[source_file]['include_dirs']]
+        prefixes = tuple(os.path.join(key(d), '') for d in dirs)
+        if not any(path.startswith(prefixes) for path in dirty_headers):
+            clean.append(source_file)
+    
+    return clean
+
+def _file_pattern(source_file):
+    """Return a regex matching exactly source_file for run-clang-tidy.
+    
+    run-clang-tidy searches its positional regexes anywhere in the absolute
+    file paths from compile_commands.json. Anchor the pattern to the whole
+    absolute path so e.g. main.cpp cannot also select Fractura/src/main.cpp,
+    and accept either separator so it holds on Windows too.
+    """
+    parts = os.path.abspath(source_file).replace('\\', '/').split('/')
+    return r'(^|[\\/])' + r'[\\/]'.join(re.escape(part) for part in parts if part) + '$'
+
+def _run_clang_tidy_driver(driver, build_dir, source_files, jobs, log=print):
+    """Run all files through run-clang-tidy.
+    
+    Returns the sets of files with warnings and with errors, and the driver's
+    exit code.
+    """
+    cmd = [driver, '-p', build_dir, '-quiet']
+    if jobs:
+        cmd += ['-j', str(jobs)]
+    cmd += [_file_pattern(source_file) for source_file in source_files]
+    
+    warning_files = set()
+    error_files = set()
+    
+    def report(line):
+        match = DIAGNOSTIC_RE.match(line)
+        if match:
+            path, kind = match.groups()
+            (warning_files if kind == 'warning' else error_files).add(path)
+        log(line)
+    
+    returncode = stream_command(cmd, report)
+    return warning_files, error_files, returncode
+
+def run_clang_tidy(build_dir, jobs=None, cache_file=None, log=print, quiet=False):
     """Run clang-tidy static analysis."""
-    print("\n" + "="*60)
-    print("Running clang-tidy...")
-    print("="*60)
+    if not quiet:
+        log(banner("Running clang-tidy..."))
     
     compile_commands = os.path.join(build_dir, 'compile_commands.json')
     
     if not os.path.exists(compile_commands):
-        print(f"ERROR: {compile_commands} not found!")
-        print("Please build the project with CMAKE_EXPORT_COMPILE_COMMANDS=ON")
+        log(f"ERROR: {compile_commands} not found!\n"
+            "Please build the project with CMAKE_EXPORT_COMPILE_COMMANDS=ON")
         return 1
     
-    # Find source files
-    source_files = []
-    for root, dirs, files in os.walk('.'):
-        dirs[:] = [d for d in dirs if d not in ['build', 'external', '.git']]
-        for file in files:
-            if file.endswith(('.cpp', '.cc', '.cxx')):
-                source_files.append(os.path.join(root, file))
+    # Analyze exactly the translation units the build compiles
+    try:
+        units = load_compile_commands(compile_commands)
+    except (OSError, ValueError, KeyError) as e:
+        log(f"ERROR: Could not read {compile_commands}: {e}")
+        return 1
     
-    if not source_files:
-        print("No source files found!")
+    if not units:
+        log("No source files found!")
         return 0
     
-    print(f"Analyzing {len(source_files)} source files...")
+    # Skip files that were clean last time and have not changed since
+    source_files = sorted(units)
+    if cache_file:
+        cache = load_tidy_cache(cache_file)
+        stamps = {source_file: _tidy_stamp(source_file, unit, build_dir)
+                  for source_file, unit in units.items()}
+        source_files = [f for f in source_files
+                        if stamps[f] is None or cache.get(f) != stamps[f]]
     
-    issues_found = 0
-    for source_file in source_files:
-        cmd = [
-            'clang-tidy',
-            source_file,
-            f'-p={build_dir}',
-            '--quiet'
-        ]
-        
+    if not quiet:
+        status = []
+        skipped = len(units) - len(source_files)
+        if skipped:
+            status.append(f"Skipping {skipped} unchanged source files.")
+        status.append(f"Analyzing {len(source_files)} source files...")
+        log('\n'.join(status))
+    
+    clean_files = []
+    
+    # Prefer LLVM's own parallel driver; fall back to batched clang-tidy runs
+    driver = find_run_clang_tidy()
+    if not source_files:
+        issues_found = 0
+    elif driver:
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.stdout and 'warning:' in result.stdout:
-                print(f"\nIssues in {source_file}:")
-                print(result.stdout)
-                issues_found += 1
-                
+            warning_files, error_files, returncode = _run_clang_tidy_driver(
+                driver, build_dir, source_files, jobs, log)
         except Exception as e:
-            print(f"Error analyzing {source_file}: {e}")
+            log(f"Error running {driver}: {e}")
+            return 1
+        
+        issues_found = len(warning_files)
+        # A failure without any error diagnostic cannot be pinned on a file,
+        # so nothing from such a run is cached.
+        if returncode == 0 or error_files:
+            clean_files = _clean_units(source_files, units, warning_files | error_files)
+    else:
+        warning_files = set()
+        # Hand each clang-tidy process a batch of files to amortize its
+        # startup, but keep enough batches to give every job some work.
+        batch_size = max(1, min(TIDY_BATCH_SIZE, -(-len(source_files) // (jobs or 1))))
+        batches = [source_files[i:i + batch_size]
+                   for i in range(0, len(source_files), batch_size)]
+        
+        # The work happens in the child processes, so a thread pool is enough
+        # to keep every core busy.
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(_tidy_batch, batch, build_dir): batch
+                       for batch in batches}
+            
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    _, stdout, returncode = future.result()
+                    
+                    diagnostics = DIAGNOSTIC_BYTES_RE.findall(stdout)
+                    batch_warnings = {path.decode(errors='replace')
+                                      for path, kind in diagnostics if kind == b'warning'}
+                    batch_errors = {path.decode(errors='replace')
+                                    for path, kind in diagnostics if kind == b'error'}
+                    if batch_warnings:
+                        log(f"\nIssues in {', '.join(sorted(batch_warnings))}:\n"
+                            + stdout.decode(errors='replace'))
+                        warning_files |= batch_warnings
+                    if returncode == 0 or batch_errors:
+                        clean_files.extend(_clean_units(
+                            batch, units, batch_warnings | batch_errors))
+                        
+                except Exception as e:
+                    log(f"Error analyzing {', '.join(batch)}: {e}")
+        
+        issues_found = len(warning_files)
+    
+    if cache_file:
+        for source_file in source_files:
+            cache.pop(source_file, None)
+        for source_file in clean_files:
+            if stamps[source_file] is not None:
+                cache[source_file] = stamps[source_file]
+        save_tidy_cache(cache_file, cache, log)
     
     if issues_found == 0:
-        print("No issues found by clang-tidy!")
+        log("No issues found by clang-tidy!")
     else:
-        print(f"\nclang-tidy found issues in {issues_found} files.")
+        log(f"\nclang-tidy found issues in {issues_found} files.")
     
     return 0
 
-def run_include_what_you_use():
+def run_include_what_you_use(log=print, quiet=False):
     """Run include-what-you-use analysis."""
-    print("\n" + "="*60)
-    print("Running include-what-you-use...")
-    print("="*60)
+    if not quiet:
+        log(banner("Running include-what-you-use..."))
     
-    print("include-what-you-use requires compilation with special flags.")
-    print("This is complex to set up automatically. Please refer to:")
-    print("https://include-what-you-use.org/")
+    log("include-what-you-use requires compilation with special flags.\n"
+        "This is complex to set up automatically. Please refer to:\n"
+        "https://include-what-you-use.org/")
     
     return 0
 
@@ -140,45 +476,74 @@ def main():
                        default='all', help='Which tool to run')
     parser.add_argument('--build-dir', default='build',
                        help='Build directory (for clang-tidy)')
+    parser.add_argument('--jobs', '-j', type=positive_int, default=os.cpu_count() or 1,
+                       help='Number of parallel analysis jobs (default: CPU count)')
+    parser.add_argument('--cache-dir', default='.cppcheck-cache',
+                       help='cppcheck build directory for incremental analysis '
+                            '(empty string to disable)')
+    parser.add_argument('--tidy-cache', default='.clang-tidy-cache.json',
+                       help='File caching clean clang-tidy results between runs '
+                            '(empty string to disable)')
+    parser.add_argument('--quiet', '-q', action='store_true',
+                       help='Only print diagnostics, errors and summaries (for CI logs)')
     
     args = parser.parse_args()
     
-    print("Caelis Static Analysis")
-    print("="*60)
+    if not args.quiet:
+        print("Caelis Static Analysis\n" + "="*60)
     
     # Define source directories
     source_dirs = ['SilicaEngine/src', 'SilicaEngine/include', 'Fractura/src']
     
-    # Check available tools
-    tools_available = {}
+    # Collect the analysis phases to run, checking each tool only when it
+    # has been selected
+    phases = []
     
-    if args.tool in ['cppcheck', 'all']:
-        tools_available['cppcheck'] = check_tool('cppcheck', 
-            'apt install cppcheck / brew install cppcheck / choco install cppcheck')
+    if args.tool in ['cppcheck', 'all'] and check_tool('cppcheck',
+            'apt install cppcheck / brew install cppcheck / choco install cppcheck',
+            quiet=args.quiet):
+        phases.append(('cppcheck', True, lambda log, jobs: run_cppcheck(
+            source_dirs, jobs, args.cache_dir, log, args.quiet)))
     
-    if args.tool in ['clang-tidy', 'all']:
-        tools_available['clang-tidy'] = check_tool('clang-tidy',
-            'apt install clang-tidy / brew install llvm / install LLVM')
+    if args.tool in ['clang-tidy', 'all'] and check_tool('clang-tidy',
+            'apt install clang-tidy / brew install llvm / install LLVM',
+            quiet=args.quiet):
+        phases.append(('clang-tidy', True, lambda log, jobs: run_clang_tidy(
+            args.build_dir, jobs, args.tidy_cache, log, args.quiet)))
     
+    # The include-what-you-use step only prints setup guidance, so it runs
+    # whether or not the binary is present
     if args.tool in ['iwyu', 'all']:
-        tools_available['iwyu'] = check_tool('include-what-you-use',
-            'Complex setup - see https://include-what-you-use.org/')
+        check_tool('include-what-you-use',
+            'Complex setup - see https://include-what-you-use.org/',
+            quiet=args.quiet)
+        phases.append(('iwyu', False, lambda log, jobs: run_include_what_you_use(
+            log, args.quiet)))
     
-    # Run available tools
     exit_code = 0
     
-    if args.tool in ['cppcheck', 'all'] and tools_available.get('cppcheck'):
-        exit_code |= run_cppcheck(source_dirs)
-    
-    if args.tool in ['clang-tidy', 'all'] and tools_available.get('clang-tidy'):
-        exit_code |= run_clang_tidy(args.build_dir)
+    # The tools share no state, so run them side by side when there is more
+    # than one. The CPU-bound ones split the job budget between them instead
+    # of each starting --jobs processes; with fewer jobs than such tools they
+    # stay sequential.
+    heavy = sum(1 for _, is_heavy, _ in phases if is_heavy)
     
-    if args.tool in ['iwyu', 'all']:
-        exit_code |= run_include_what_you_use()
+    if len(phases) > 1 and args.jobs >= heavy:
+        shares = [args.jobs // heavy + (1 if i < args.jobs % heavy else 0)
+                  for i in range(heavy)] if heavy else []
+        with ThreadPoolExecutor(max_workers=len(phases)) as executor:
+            futures = []
+            for name, is_heavy, run in phases:
+                jobs = shares.pop(0) if is_heavy else 1
+                futures.append(executor.submit(run, prefixed_log(name), jobs))
+            for future in futures:
+                exit_code |= future.result()
+    else:
+        for _, _, run in phases:
+            exit_code |= run(functools.partial(print, flush=True), args.jobs)
     
-    print("\n" + "="*60)
-    print("Static analysis completed!")
-    print("="*60)
+    if not args.quiet:
+        print(banner("Static analysis completed!"))
     
     return exit_code
 
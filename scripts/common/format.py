@@ -10,28 +10,29 @@ import os
 import sys
 import subprocess
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from _fs import SKIP_DIRS, positive_int, walk_sources
+
+SOURCE_EXTENSIONS = ('.cpp', '.c', '.h', '.hpp', '.cc', '.cxx')
+
+# Number of files handed to one clang-format process
+BATCH_SIZE = 32
+
 def find_source_files(directory):
     """Find all C++ source files in the directory."""
-    extensions = ['.cpp', '.c', '.h', '.hpp', '.cc', '.cxx']
-    source_files = []
-    
-    for root, dirs, files in os.walk(directory):
-        # Skip build and external directories
-        dirs[:] = [d for d in dirs if d not in ['build', 'external', '.git']]
-        
-        for file in files:
-            if any(file.endswith(ext) for ext in extensions):
-                source_files.append(os.path.join(root, file))
-    
-    return source_files
+    return list(walk_sources(directory, SOURCE_EXTENSIONS, SKIP_DIRS))
+
+def batches_of(items, size=BATCH_SIZE):
+    """Split a list into consecutive chunks of at most size items."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
 
 def check_clang_format():
     """Check if clang-format is available."""
     try:
-        result = subprocess.run(['clang-format', '--version'], 
-                              capture_output=True, text=True)
+        result = subprocess.run(['clang-format', '--version'], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True)
         if result.returncode == 0:
             print(f"Found clang-format: {result.stdout.strip()}")
             return True
@@ -45,22 +46,45 @@ def check_clang_format():
     print("  macOS: brew install clang-format")
     return False
 
-def format_file(file_path, dry_run=False):
-    """Format a single file with clang-format."""
+def needs_formatting(file_paths):
+    """Check whether clang-format would change any of the given files."""
+    result = subprocess.run(['clang-format', '--dry-run', '--Werror', *file_paths],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode != 0
+
+def format_in_place(file_paths):
+    """Format the given files in-place, returning True if all succeeded."""
+    result = subprocess.run(['clang-format', '-i', *file_paths],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+def format_files_batch(file_paths, dry_run=False):
+    """Format a batch of files with clang-format.
+    
+    Returns a list of (file_path, result) pairs. In dry-run mode the result is
+    True if the file needs formatting, otherwise True if formatting succeeded.
+    """
     try:
         if dry_run:
-            # Check if formatting would change the file
-            result = subprocess.run(['clang-format', '--dry-run', '--Werror', file_path],
-                                  capture_output=True, text=True)
-            return result.returncode != 0  # Returns True if formatting needed
+            # Check the whole batch at once; --Werror fails if any file would
+            # change, so only then re-check files one by one to find them.
+            if not needs_formatting(file_paths):
+                return [(file_path, False) for file_path in file_paths]
+            if len(file_paths) == 1:
+                return [(file_paths[0], True)]
+            return [(file_path, needs_formatting([file_path])) for file_path in file_paths]
         else:
-            # Format the file in-place
-            result = subprocess.run(['clang-format', '-i', file_path],
-                                  capture_output=True, text=True)
-            return result.returncode == 0  # Returns True if successful
+            # Format all files in-place with a single clang-format process.
+            # It keeps going past a file it cannot format, so on failure
+            # re-run files one by one to find the ones that actually failed.
+            if format_in_place(file_paths):
+                return [(file_path, True) for file_path in file_paths]
+            if len(file_paths) == 1:
+                return [(file_paths[0], False)]
+            return [(file_path, format_in_place([file_path])) for file_path in file_paths]
     except Exception as e:
-        print(f"Error formatting {file_path}: {e}")
-        return False
+        print(f"Error formatting {', '.join(file_paths)}: {e}")
+        return [(file_path, False) for file_path in file_paths]
 
 def main():
     parser = argparse.ArgumentParser(description='Format C++ source code with clang-format')
@@ -68,6 +92,8 @@ def main():
                        help='Check if files need formatting (dry run)')
     parser.add_argument('--directory', '-d', default='.',
                        help='Directory to format (default: current directory)')
+    parser.add_argument('--jobs', '-j', type=positive_int, default=os.cpu_count() or 1,
+                       help='Number of parallel clang-format jobs (default: CPU count)')
     
     args = parser.parse_args()
     
@@ -89,8 +115,14 @@ def main():
         print("Checking formatting...")
         files_needing_format = []
         
-        for file_path in source_files:
-            if format_file(file_path, dry_run=True):
+        # clang-format runs in child processes, so threads are enough here
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            batches = executor.map(lambda b: format_files_batch(b, dry_run=True),
+                                   batches_of(source_files))
+            results = [result for batch in batches for result in batch]
+        
+        for file_path, needs_format in results:
+            if needs_format:
                 files_needing_format.append(file_path)
                 print(f"  NEEDS FORMATTING: {file_path}")
             else:
@@ -107,8 +139,13 @@ def main():
         print("Formatting files...")
         formatted_count = 0
         
-        for file_path in source_files:
-            if format_file(file_path, dry_run=False):
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            batches = executor.map(lambda b: format_files_batch(b, dry_run=False),
+                                   batches_of(source_files))
+            results = [result for batch in batches for result in batch]
+        
+        for file_path, success in results:
+            if success:
                 print(f"  FORMATTED: {file_path}")
                 formatted_count += 1
             else: